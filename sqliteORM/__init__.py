@@ -1,3 +1,3 @@
 from .db import DBTable
 from .rows import Row
-
+from .aggregates import Aggregate
@@ -0,0 +1,163 @@
+from . import rows
+from . import checks
+from . import logger_builder
+
+logger = logger_builder.build_logger(__name__)
+
+class AggregateError(Exception):
+    pass
+
+class Aggregate():
+    def __init__(self,
+            name,
+            group_by: rows.Row | str | list[rows.Row | str],
+            sum: rows.Row | str | list[rows.Row | str] =None,
+            count=False
+        ):
+        if not isinstance(group_by, (list, tuple)):
+            group_by = [group_by]
+        if sum is None:
+            sum = []
+        elif not isinstance(sum, (list, tuple)):
+            sum = [sum]
+        
+        if not group_by:
+            raise AggregateError(f"The aggregate '{name}' needs at least one row to group by")
+        if not sum and not count:
+            raise AggregateError(f"The aggregate '{name}' has nothing to compute")
+        
+        self._name = name
+        self._group_by = list(map(checks.get_row_name, group_by))
+        self._sum = list(map(checks.get_row_name, sum))
+        self._count = count
+        self.table = None
+    
+    def get_table_name(self) -> str:
+        return self._name.lower()
+    
+    def get_rebuild_table_name(self) -> str:
+        return f"{self.get_table_name()}_rebuild"
+    
+    def get_rebuild_state_name(self) -> str:
+        return f"{self.get_table_name()}_rebuild_state"
+    
+    def get_triggers_names(self, table=None) -> list[str]:
+        table = table or self.get_table_name()
+        return [f"{table}_after_insert", f"{table}_after_delete", f"{table}_after_update"]
+    
+    def get_source_name(self) -> str:
+        return self.table.__name__.lower()
+    
+    def get_group_by(self) -> list[str]:
+        return self._group_by
+    
+    def get_sum_columns(self) -> dict[str, str]:
+        # nom de la colonne de la table résumé -> nom de la row sommée
+        return {f"sum_{name}": name for name in self._sum}
+    
+    def is_counting(self):
+        return self._count
+    
+    def get_count_column(self) -> str:
+        # le nombre de lignes est toujours gardé pour supprimer les groupes vides, caché si non demandé
+        return "count" if self.is_counting() else "_count"
+    
+    def get_value_columns(self) -> list[str]:
+        columns = ["count"] if self.is_counting() else []
+        columns += list(self.get_sum_columns().keys())
+        return columns
+    
+    def get_stored_columns(self) -> list[str]:
+        return [self.get_count_column()] + list(self.get_sum_columns().keys())
+    
+    def get_select_string(self, where="") -> str:
+        columns = ", ".join(self._group_by + self.get_value_columns())
+        return f"SELECT {columns} FROM {self.get_table_name()}{where}"
+    
+    def validate(self):
+        if self.table is None:
+            raise AggregateError(f"The aggregate '{self._name}' isn't linked to a table")
+        
+        for name in self._group_by + self._sum:
+            if self.table.rows.get(name.lower()) is None:
+                raise AggregateError(f"The row '{name}' doesn't exist in {self.table.__name__}")
+        
+        return True
+    
+    def _where(self, prefix) -> str:
+        # IS au lieu de = pour que les groupes NULL soient aussi retrouvés
+        return " AND ".join(f"{name} IS {prefix}.{name}" for name in self._group_by)
+    
+    def _rebuild_condition(self, prefix) -> str:
+        # pendant une reconstruction, seules les lignes déjà recopiées dans la table de reconstruction
+        # et les lignes ajoutées après son début la modifient, les autres seront lues par les lots suivants
+        state = self.get_rebuild_state_name()
+        return f" AND ({prefix}.rowid <= (SELECT progress FROM {state}) OR {prefix}.rowid > (SELECT last FROM {state}))"
+    
+    def _add_statements(self, prefix, sign, table, rebuilding=False) -> str:
+        condition = self._rebuild_condition(prefix) if rebuilding else ""
+        group_by = ", ".join(self._group_by)
+        
+        count = self.get_count_column()
+        updates = [f"{count} = {count} {sign} 1"]
+        for column, name in self.get_sum_columns().items():
+            updates.append(f"{column} = {column} {sign} COALESCE({prefix}.{name}, 0)")
+        
+        string = ""
+        # cré le groupe s'il n'existe pas encore
+        if sign == "+":
+            string += f"INSERT INTO {table} ({group_by}) "
+            string += f"SELECT {', '.join(f'{prefix}.{name}' for name in self._group_by)} "
+            string += f"WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {self._where(prefix)}){condition};\n"
+        
+        string += f"UPDATE {table} SET {', '.join(updates)} WHERE {self._where(prefix)}{condition};\n"
+        
+        # supprime le groupe quand il n'a plus de ligne
+        if sign == "-":
+            string += f"DELETE FROM {table} WHERE {self._where(prefix)} AND {count} <= 0;\n"
+        
+        return string
+    
+    def get_string(self, table=None):
+        end_line = ", \n"
+        string = f"""CREATE TABLE IF NOT EXISTS {table or self.get_table_name()} (\n"""
+        
+        for name in self._group_by:
+            string += f"{name} {self.table.rows[name.lower()].get_row_type()}" + end_line
+        
+        string += f"{self.get_count_column()} INTEGER NOT NULL DEFAULT 0" + end_line
+        for column in self.get_sum_columns().keys():
+            string += f"{column} NUMERIC NOT NULL DEFAULT 0" + end_line
+        
+        # UNIQUE plutôt que PRIMARY KEY : une clé INTEGER PRIMARY KEY remplacerait NULL par un rowid
+        string += f"UNIQUE ({', '.join(self._group_by)})"
+        string += ")"
+        
+        return string
+    
+    def get_triggers_strings(self, table=None, rebuilding=False) -> list[str]:
+        table = table or self.get_table_name()
+        insert, delete, update = self.get_triggers_names(table)
+        source = self.get_source_name()
+        watched = ", ".join(self._group_by + self._sum)
+        
+        strings = [
+            f"CREATE TRIGGER IF NOT EXISTS {insert} AFTER INSERT ON {source} BEGIN\n"
+            + self._add_statements("NEW", "+", table, rebuilding)
+            + "END",
+            
+            f"CREATE TRIGGER IF NOT EXISTS {delete} AFTER DELETE ON {source} BEGIN\n"
+            + self._add_statements("OLD", "-", table, rebuilding)
+            + "END",
+            
+            f"CREATE TRIGGER IF NOT EXISTS {update} AFTER UPDATE OF {watched} ON {source} BEGIN\n"
+            + self._add_statements("OLD", "-", table, rebuilding)
+            + self._add_statements("NEW", "+", table, rebuilding)
+            + "END",
+        ]
+        
+        logger.debug(str(strings))
+        return strings
+    
+    def __repr__(self):
+        return f"Aggregate(name={self._name}, group_by={self._group_by}, sum={self._sum}, count={self._count})"
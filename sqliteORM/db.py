@@ -1,10 +1,20 @@
 from functools import partial
 from typing import Any, Iterable, Iterator
 import sqlite3
+import threading
+import tempfile
+import pathlib
+import weakref
+import shutil
+import itertools
+import heapq
+import time
+import zlib
 import os
 
 from . import rows
 from . import checks
+from . import aggregates
 
 class ArgumentError(Exception):
     pass
@@ -25,6 +35,8 @@ class DuplicatedRowError(ArgumentError):
 
 class DBTable:
     db = None
+    # clé de partitionnement : nom de row, Row ou fonction qui prend le dict des valeurs
+    shard_by = None
     
     def __init__(self, **kwargs) -> None:
         super().__init__()
@@ -39,12 +51,40 @@ class DBTable:
         if already_exists and self.__class__.get_data(**kwargs) == kwargs:
             return
         
+        db = type(self).db
+        
+        # trouve le shard dans lequel écrire la ligne
+        shard = db.get_shard_index(type(self), kwargs)
+        if shard is None:
+            raise ArgumentError(f"Can't find the shard key of {type(self).__name__} in {kwargs}")
+        
+        columns = list(kwargs.keys())
+        values = ["?"] * len(kwargs)
+        params = list(kwargs.values())
+        
+        # dans une table partitionnée les ids sont espacés du nombre de shards pour rester uniques :
+        # le shard s utilise s + 1, s + 1 + N, s + 1 + 2N...
+        id_name = type(self).get_id_row_name()
+        if db.is_sharded(type(self)) and id_name is not None:
+            if id_name in kwargs:
+                if db.get_id_shard(kwargs[id_name]) != shard:
+                    raise ArgumentError(f"The id {kwargs[id_name]} doesn't belong to the shard {shard} of {type(self).__name__}")
+            else:
+                # sqlite_sequence garde le plus grand id jamais utilisé : l'id d'une ligne supprimée n'est pas réutilisé
+                columns.insert(0, id_name)
+                values.insert(0, "(SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), ?) + ?)")
+                params = [type(self).__name__.lower(), shard + 1 - db.shards, db.shards] + params
+        
         try:
-            string = f"INSERT INTO {type(self).__name__} ({', '.join(kwargs.keys())}) VALUES ({', '.join(['?'] * len(kwargs.values()))})"
+            string = f"INSERT INTO {type(self).__name__} ({', '.join(columns)}) VALUES ({', '.join(values)})"
             logger.debug(string)
-            cursor = type(self).db.execute(string, kwargs.values())
+            cursor = db.execute(string, params, shard=shard)
+            
+            # execute retourne None quand l'insertion a échoué (ligne déjà existante, base verrouillée...)
+            if cursor is None:
+                raise sqlite3.DatabaseError(f"Can't insert {kwargs} in {type(self).__name__}, see the logs")
             
-            self._values = self.__class__.get_data(id=cursor.lastrowid)
+            self._values = self.__class__.get_data(_shard=shard, id=cursor.lastrowid)
         except sqlite3.IntegrityError:
             self._values = self.__class__.get_data(**kwargs)
         
@@ -63,6 +103,27 @@ class DBTable:
         else:
             raise DuplicatedRowError(cls.rows[name], row)
     
+    @classmethod
+    def get_id_row_name(cls):
+        for name, row in cls.rows.items():
+            if row.is_primary() and row.is_autoincrement():
+                return name
+        
+        return None
+    
+    @classmethod
+    def add_aggregate(cls, aggregate: aggregates.Aggregate):
+        if getattr(cls, "aggregates", None) is None:
+            cls.aggregates = {}
+        
+        name = aggregate.get_table_name()
+        if name in cls.aggregates:
+            raise ArgumentError(f"Duplicated aggregate of name {name}")
+        
+        aggregate.table = cls
+        aggregate.validate()
+        cls.aggregates[name] = aggregate
+    
     @classmethod
     def validate_rows(cls):
         for row in cls.rows:
@@ -120,20 +181,19 @@ class DBTable:
         return string
     
     @classmethod
-    def get_data(cls, **kwargs):
-        args_list = []
-        for key, value in kwargs.items():
-            args_list.append(value)
-        
-        string = f"SELECT * FROM {cls.__name__} WHERE (" + " AND ".join([f"{row_name} = ?" for row_name in kwargs.keys()]) + ")"
-        print(string)
-        r = cls.db.execute(string, args_list)
+    def get_data(cls, _shard=None, **kwargs):
+        # va directement dans un shard si la clé est connue, sinon cherche dans tous les shards
+        r = cls.db.select(cls, _shard=_shard, **kwargs)
         
         print(r, dir(r))
         value = r.fetchone()
         print(value)
         found_args = {}
         
+        # aucune ligne trouvée
+        if value is None:
+            return found_args
+        
         row_conter = 0
         for k, v in cls.rows.items():
             print(row_conter, (k, v))
@@ -185,39 +245,192 @@ class DBTable:
     
     
 
+def sql_sort_key(value):
+    # même ordre que sqlite : NULL, nombres, textes puis blobs
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, value)
+
+class ShardsCursor:
+    # résultat fusionné des lectures faites dans chaque shard, se lit comme un sqlite3.Cursor
+    def __init__(self, description, rows):
+        self.description = description
+        self._rows = iter(rows)
+    
+    def fetchone(self):
+        return next(self._rows, None)
+    
+    def fetchall(self):
+        return list(self._rows)
+    
+    def __iter__(self):
+        return self._rows
+    
+
+class SnapshotConnection(sqlite3.Connection):
+    # connection en lecture seule sur une copie, supprime ses fichiers temporaires à la fermeture
+    # ou, si elle n'est pas fermée, quand elle est détruite par le garbage collector
+    temp_dir = None
+    _cleanup = None
+    
+    def remove_on_close(self, temp_dir):
+        self.temp_dir = temp_dir
+        self._cleanup = weakref.finalize(self, shutil.rmtree, temp_dir, True)
+    
+    def close(self):
+        super().close()
+        if self._cleanup is not None:
+            self._cleanup()
+    
+
+# nombre maximum de bases attachées à une connection dans sqlite (SQLITE_MAX_ATTACHED) + la principale
+MAX_SHARDS = 11
+
 class DB():
     def __init__(self, 
             tables: set[DBTable] =set(), 
             path=os.path.join(os.path.dirname(__file__), "data", "db.db"), 
-            debug=False
+            debug=False,
+            shards=1,
+            wal=False
         ) -> None:
         if not os.path.exists(os.path.dirname(path)):
             os.makedirs(os.path.dirname(path))
         
+        # les shards 1 à N-1 sont attachés à la connection principale, sqlite en accepte 10 par défaut
+        if shards < 1 or shards > MAX_SHARDS:
+            raise ArgumentError(f"Invalid number of shards : {shards}, it must be between 1 and {MAX_SHARDS}")
+        
         self.path = path
         print(self.path)
-        self.conn = sqlite3.connect(self.path)
+        self.shards = shards
+        # le mode WAL est gardé dans les fichiers : les lectures (backup, snapshot...) ne bloquent plus les
+        # écritures, mais les fichiers -wal et -shm font partie de la base et doivent être copiés avec elle
+        self.wal = wal
+        # une connection par thread et par shard : chaque thread a ses propres transactions
+        # et les écritures de shards différents se font en parallèle
+        self._local = threading.local()
+        for shard in range(shards):
+            self.get_conn(True, shard)
         self.tables = tables
         self.debug = debug
     
+    @property
+    def conns(self):
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = [None] * self.shards
+            self._local.conns = conns
+        
+        return conns
+    
+    @property
+    def conn(self):
+        return self.conns[0]
+    
+    @conn.setter
+    def conn(self, value):
+        self.conns[0] = value
+    
+    @staticmethod
+    def get_shard_path(path, shard):
+        # le shard 0 est le fichier principal, les autres sont à côté : db.shard1.db, db.shard2.db...
+        if shard == 0:
+            return path
+        
+        base, ext = os.path.splitext(path)
+        return f"{base}.shard{shard}{ext}"
+    
+    @staticmethod
+    def get_shard_schema(shard):
+        return "main" if shard == 0 else f"shard{shard}"
+    
+    def is_sharded(self, table: DBTable):
+        return self.shards > 1 and getattr(table, "shard_by", None) is not None
+    
+    def get_id_shard(self, id):
+        return (id - 1) % self.shards
+    
+    def get_shard_index(self, table: DBTable, values: dict):
+        if not self.is_sharded(table):
+            return 0
+        
+        shard_by = table.shard_by
+        
+        # calcule la clé, retourne None si elle ne peut pas être trouvée dans les valeurs
+        try:
+            if callable(shard_by):
+                key = shard_by(values)
+            else:
+                key = values[checks.get_row_name(shard_by)]
+        except KeyError:
+            # sans la clé, l'id suffit à retrouver le shard
+            id_name = table.get_id_row_name()
+            if id_name is not None and values.get(id_name) is not None:
+                return self.get_id_shard(values[id_name])
+            
+            return None
+        
+        if isinstance(key, int):
+            return key % self.shards
+        
+        # crc32 plutôt que hash() qui change à chaque lancement de python
+        return zlib.crc32(str(key).encode()) % self.shards
+    
     def add_table(self, table: DBTable) -> None:
         table.create()
         self.tables.add(table)
         table.db = self
     
-    def get_conn(self, force_new = False):
+    def get_conn(self, force_new = False, shard=0):
         # La connection existe déja et une nouvelle n'est pas demandée
-        if (not force_new) and (self.conn is not None):
-            return self.conn
+        if (not force_new) and (self.conns[shard] is not None):
+            return self.conns[shard]
         
         #cré une nouvelle connection
         try:
-            self.conn = sqlite3.connect(self.path)
+            self.conns[shard] = self.connect(self.path, shard)
         except Exception as e:
             logger.exception("Error in getting connection, force = " + str(force_new))
+            raise e
         
-        return self.conn
+        return self.conns[shard]
 
+    def connect(self, path, shard=0, read_only=False, factory=sqlite3.Connection):
+        def get_target(i):
+            target = self.get_shard_path(path, i)
+            if read_only:
+                target = pathlib.Path(target).resolve().as_uri() + "?mode=ro"
+            return target
+        
+        conn = sqlite3.connect(get_target(shard), uri=read_only, factory=factory)
+        
+        # attache les autres shards à la connection principale pour les lectures avec UNION ALL
+        if shard == 0:
+            for i in range(1, self.shards):
+                conn.execute(f"ATTACH DATABASE ? AS {self.get_shard_schema(i)}", (get_target(i),))
+        
+        if self.wal and not read_only:
+            self.set_wal(conn, shard)
+        
+        return conn
+    
+    def set_wal(self, conn, shard):
+        if conn.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal":
+            return
+        
+        # le changement de mode a besoin d'un verrou exclusif sur le fichier
+        if any(other is not None and other.in_transaction for other in self.conns):
+            raise ArgumentError(f"Can't switch shard {shard} to WAL while a transaction is open")
+        
+        mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        if mode.lower() != "wal":
+            logger.warning(f"Can't switch shard {shard} to WAL, journal mode is {mode}")
+    
     def create_tables(self):
         if not self.debug:
             self.debug = True
@@ -226,8 +439,18 @@ class DB():
             string = table.get_string()
             print("\n")
             print(string)
-            r = self.execute(string)
-            print(r)
+            
+            # une table partitionnée est créée dans chaque shard
+            shards = range(self.shards) if self.is_sharded(table) else [0]
+            for shard in shards:
+                r = self.execute(string, shard=shard)
+                print(r)
+                
+                # les tables résumé et leurs triggers sont dans le même fichier que la table source
+                for aggregate in getattr(table, "aggregates", {}).values():
+                    self.execute(aggregate.get_string(), shard=shard)
+                    for trigger in aggregate.get_triggers_strings():
+                        self.execute(trigger, shard=shard)
         
         self.commit("Tables créées", force_commit=True)
     
@@ -243,30 +466,31 @@ class DB():
         self.execute(string)
     
     def commit(self, message="", force_commit=False):
-        conn = self.get_conn()
-        
-        # retourne si pas de changement
-        if conn.total_changes <= 0 and not force_commit:
-            print(conn.total_changes)
-            return
-        
         # cré le message de commit s'il y en a un
         if message:
             message = f"Committing for '{message}'"
         
-        # Essaie de commit et debug le résultat sinon log l'erreur
-        try:
-            conn.commit()
-            if self.debug:
-                message = message.format(changes=conn.total_changes)
-                print(message)
-                logger.debug(message)
-        except Exception as e:
-            logger.error(message, exc_info=True)
+        for shard in range(self.shards):
+            conn = self.get_conn(shard=shard)
+            
+            # passe au shard suivant si pas de changement
+            if conn.total_changes <= 0 and not force_commit:
+                print(conn.total_changes)
+                continue
+            
+            # Essaie de commit et debug le résultat sinon log l'erreur
+            try:
+                conn.commit()
+                if self.debug:
+                    shard_message = message.format(changes=conn.total_changes)
+                    print(shard_message)
+                    logger.debug(shard_message)
+            except Exception as e:
+                logger.error(message, exc_info=True)
     
-    def execute(self, command: str, params_tuple: tuple =(), many=False, force_new=False):
+    def execute(self, command: str, params_tuple: tuple =(), many=False, force_new=False, shard=0):
         params_tuple = tuple(params_tuple)
-        conn = self.get_conn(force_new)
+        conn = self.get_conn(force_new, shard)
         r = None
         
         try:
@@ -283,7 +507,7 @@ class DB():
         except sqlite3.ProgrammingError as e:
             conn.rollback()
             if "Cannot operate on a closed database." in str(e):
-                r = self.execute(command, params_tuple, many, force_new=True)
+                r = self.execute(command, params_tuple, many, force_new=True, shard=shard)
             else:
                 raise e
         except Exception as e:
@@ -292,4 +516,262 @@ class DB():
             logger.exception("Unhandled error in execute for " + command + " with parameters " + str(params_tuple))
             print("\n")
         
-        return r
\ No newline at end of file
+        return r
+    
+    def select(self, _table: DBTable, _order_by: rows.Row | str =None, _ascending=True, _shard=None, **kwargs):
+        # les paramètres commencent par '_' comme les noms de row ne le peuvent pas
+        table = _table.__name__.lower()
+        params = tuple(kwargs.values())
+        
+        where = ""
+        if kwargs:
+            where = " WHERE (" + " AND ".join([f"{row_name} = ?" for row_name in kwargs.keys()]) + ")"
+        
+        order = ""
+        if _order_by is not None:
+            order = f" ORDER BY {checks.get_row_name(_order_by)} {'ASC' if _ascending else 'DESC'}"
+        
+        shard = _shard
+        if shard is None:
+            shard = self.get_shard_index(_table, kwargs)
+        
+        string = f"SELECT * FROM {table}{where}{order}"
+        logger.debug(string)
+        
+        # la clé est connue : une seule requête dans le bon shard
+        if shard is not None:
+            return self.execute(string, params, shard=shard)
+        
+        # sinon la requête est faite sur la connection de chaque shard du thread, pour voir aussi ses
+        # écritures pas encore commit, et les résultats déjà triés par shard sont fusionnés
+        cursors = [self.execute(string, params, shard=i) for i in range(self.shards)]
+        if None in cursors:
+            raise sqlite3.DatabaseError(f"Can't read {table} in every shard, see the logs")
+        
+        description = cursors[0].description
+        if _order_by is None:
+            return ShardsCursor(description, itertools.chain(*cursors))
+        
+        names = [column[0].lower() for column in description]
+        index = names.index(checks.get_row_name(_order_by).lower())
+        merged = heapq.merge(*cursors, key=lambda row: sql_sort_key(row[index]), reverse=not _ascending)
+        
+        return ShardsCursor(description, merged)
+    
+    def get_union_string(self, name, where=""):
+        # lit la table dans les shards attachés à la connection principale : seules les données commit sont vues
+        return " UNION ALL ".join(
+            f"SELECT * FROM {self.get_shard_schema(i)}.{name}{where}" for i in range(self.shards)
+        )
+    
+    def get_aggregate_string(self, aggregate: aggregates.Aggregate, where=""):
+        if not self.is_sharded(aggregate.table):
+            return aggregate.get_select_string(where)
+        
+        # un même groupe peut être présent dans plusieurs shards, les valeurs sont donc additionnées
+        group_by = ", ".join(aggregate.get_group_by())
+        string = f"SELECT {group_by}, "
+        string += ", ".join(f"SUM({column}) AS {column}" for column in aggregate.get_value_columns())
+        string += f" FROM ({self.get_union_string(aggregate.get_table_name(), where)})"
+        string += f" GROUP BY {group_by}"
+        
+        return string
+    
+    def select_aggregate(self, _aggregate: aggregates.Aggregate, **kwargs):
+        # '_aggregate' comme les noms de row ne peuvent pas commencer par '_'
+        where = ""
+        if kwargs:
+            where = " WHERE (" + " AND ".join([f"{row_name} = ?" for row_name in kwargs.keys()]) + ")"
+        
+        string = self.get_aggregate_string(_aggregate, where)
+        logger.debug(string)
+        
+        params = tuple(kwargs.values())
+        if self.is_sharded(_aggregate.table):
+            params *= self.shards
+        
+        return self.execute(string, params)
+    
+    def rebuild_aggregate(self, aggregate: aggregates.Aggregate, chunk_size=10000, progress=None):
+        table = aggregate.get_source_name()
+        name = aggregate.get_table_name()
+        rebuild = aggregate.get_rebuild_table_name()
+        state = aggregate.get_rebuild_state_name()
+        group_by = aggregate.get_group_by()
+        where = " AND ".join(f"{row_name} IS ?" for row_name in group_by)
+        
+        select = f"SELECT {', '.join(group_by)}, COUNT(*)"
+        select += "".join(f", SUM(COALESCE({row_name}, 0))" for row_name in aggregate.get_sum_columns().values())
+        select += f" FROM {table} WHERE rowid > ? AND rowid <= ? GROUP BY {', '.join(group_by)}"
+        
+        insert = f"INSERT INTO {rebuild} ({', '.join(group_by)}) SELECT {', '.join(['?'] * len(group_by))} "
+        insert += f"WHERE NOT EXISTS (SELECT 1 FROM {rebuild} WHERE {where})"
+        
+        update = f"UPDATE {rebuild} SET "
+        update += ", ".join(f"{column} = {column} + ?" for column in aggregate.get_stored_columns())
+        update += f" WHERE {where}"
+        
+        def run(conn, *statements):
+            # chaque étape est une transaction d'écriture : les autres connections voient tout ou rien
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for statement in statements:
+                    statement(conn)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise e
+        
+        def drop_rebuild(conn):
+            # supprime aussi ce qui resterait d'une reconstruction interrompue
+            for trigger in aggregate.get_triggers_names(rebuild):
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            conn.execute(f"DROP TABLE IF EXISTS {rebuild}")
+            conn.execute(f"DROP TABLE IF EXISTS {state}")
+        
+        def start_rebuild(conn):
+            # la table de reconstruction est remplie par lots et tenue à jour par ses propres triggers,
+            # la table résumé reste lisible et à jour jusqu'à l'échange final
+            conn.execute(aggregate.get_string(rebuild))
+            conn.execute(f"CREATE TABLE {state} (last INTEGER NOT NULL, progress INTEGER NOT NULL)")
+            conn.execute(f"INSERT INTO {state} (last, progress) SELECT COALESCE(MAX(rowid), 0), 0 FROM {table}")
+            for trigger in aggregate.get_triggers_strings(rebuild, rebuilding=True):
+                conn.execute(trigger)
+        
+        def swap(conn):
+            for trigger in aggregate.get_triggers_names():
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            for trigger in aggregate.get_triggers_names(rebuild):
+                conn.execute(f"DROP TRIGGER {trigger}")
+            conn.execute(f"DROP TABLE IF EXISTS {name}")
+            conn.execute(f"ALTER TABLE {rebuild} RENAME TO {name}")
+            conn.execute(f"DROP TABLE {state}")
+            for trigger in aggregate.get_triggers_strings():
+                conn.execute(trigger)
+        
+        shards = range(self.shards) if self.is_sharded(aggregate.table) else [0]
+        for shard in shards:
+            conn = self.get_conn(shard=shard)
+            if conn.in_transaction:
+                conn.commit()
+            
+            run(conn, drop_rebuild, start_rebuild)
+            last = conn.execute(f"SELECT last FROM {state}").fetchone()[0]
+            
+            # un commit par lot pour ne pas bloquer les écritures pendant toute la reconstruction
+            start = 0
+            while start < last:
+                end = min(start + chunk_size, last)
+                
+                def copy_chunk(conn):
+                    groups = conn.execute(select, (start, end)).fetchall()
+                    
+                    keys = [group[:len(group_by)] for group in groups]
+                    values = [group[len(group_by):] for group in groups]
+                    
+                    conn.executemany(insert, [key + key for key in keys])
+                    conn.executemany(update, [value + key for key, value in zip(keys, values)])
+                    conn.execute(f"UPDATE {state} SET progress = ?", (end,))
+                
+                run(conn, copy_chunk)
+                start = end
+                
+                if progress is not None:
+                    progress(shard, end, last)
+            
+            run(conn, swap)
+            logger.info(f"Aggregate {name} rebuilt in shard {shard}")
+    
+    def open_read_snapshot(self):
+        # connection dédiée, avec les shards attachés, qui garde une transaction de lecture ouverte
+        # sur chaque shard. En WAL elle voit un état figé sans bloquer les écritures des autres connections
+        conn = self.connect(self.path)
+        
+        if not self.wal:
+            logger.warning("The database isn't in WAL mode, writers will wait for the end of the copy")
+        
+        conn.execute("BEGIN")
+        for shard in range(self.shards):
+            conn.execute(f"SELECT COUNT(*) FROM {self.get_shard_schema(shard)}.sqlite_master").fetchone()
+        
+        return conn
+    
+    def copy_shard(self, source, shard, target, pages_per_step=1024, sleep=0.250, progress=None):
+        # sqlite n'attend entre deux lots que si la base est verrouillée, la pause est donc faite ici
+        def step(status, remaining, total):
+            if progress is not None:
+                progress(status, remaining, total)
+            if remaining and sleep:
+                time.sleep(sleep)
+        
+        source.backup(target, pages=pages_per_step, progress=step, name=self.get_shard_schema(shard), sleep=sleep)
+    
+    def backup(self, target_path, pages_per_step=1024, sleep=0.250, progress=None):
+        """Copie la base et ses shards dans target_path.
+        
+        La copie est lue depuis une connection dédiée qui ouvre une transaction de lecture au début de la
+        sauvegarde : seules les données déjà commit sont copiées, les transactions en cours (y compris celles
+        de l'appelant) ne sont pas touchées, et la copie ne recommence pas quand d'autres connections écrivent.
+        Elle avance par lots de pages_per_step pages séparés de sleep secondes.
+        
+        Sans écriture bloquée, seulement avec DB(wal=True) : la lecture ne gêne alors pas les écritures, mais
+        le WAL ne peut pas être vidé et grossit tant que la copie dure. Sans WAL, les commits des autres
+        connections attendent la fin de la copie (et échouent après le timeout de sqlite).
+        
+        Les transactions de lecture des shards sont ouvertes l'une après l'autre : chaque shard est cohérent
+        mais l'ensemble n'est pas figé au même instant si des écritures ont lieu pendant leur ouverture.
+        """
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+        
+        source = self.open_read_snapshot()
+        paths = []
+        try:
+            for shard in range(self.shards):
+                path = self.get_shard_path(target_path, shard)
+                target = sqlite3.connect(path)
+                
+                try:
+                    self.copy_shard(source, shard, target, pages_per_step, sleep, progress)
+                finally:
+                    target.close()
+                
+                logger.info(f"Backup of shard {shard} to '{path}' done")
+                paths.append(path)
+        finally:
+            source.close()
+        
+        return paths
+    
+    def snapshot(self, in_memory=False, pages_per_step=1024, sleep=0.250):
+        """Retourne une connection en lecture seule sur une copie de la base, faite comme avec backup.
+        
+        La copie est temporaire : elle est supprimée quand la connection est fermée, ou quand elle est
+        détruite si elle ne l'a pas été. Avec in_memory, la copie est en mémoire (base sans shard seulement).
+        """
+        if in_memory:
+            if self.shards > 1:
+                raise ArgumentError("A sharded database can't be copied in memory")
+            
+            conn = sqlite3.connect(":memory:", factory=SnapshotConnection)
+            
+            source = self.open_read_snapshot()
+            try:
+                self.copy_shard(source, 0, conn, pages_per_step, sleep)
+            finally:
+                source.close()
+        else:
+            temp_dir = tempfile.mkdtemp(prefix="sqliteORM-")
+            try:
+                path = os.path.join(temp_dir, os.path.basename(self.path))
+                self.backup(path, pages_per_step, sleep)
+                
+                # les shards sont attachés comme sur la connection principale pour pouvoir utiliser UNION ALL
+                conn = self.connect(path, read_only=True, factory=SnapshotConnection)
+            except Exception as e:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise e
+            
+            conn.remove_on_close(temp_dir)
+        
+        conn.execute("PRAGMA query_only = ON")
+        return conn
@@ -2,7 +2,8 @@ import logging
 import os
 
 
-DIR_PATH = os.path.dirname(__file__)
+# SQLITEORM_LOG_DIR permet de changer le dossier des logs, par exemple pour les tests
+DIR_PATH = os.environ.get("SQLITEORM_LOG_DIR", os.path.dirname(__file__))
 SPAM_PATH = os.path.join(DIR_PATH, "spam.log")
 FILE_PATH = os.path.join(DIR_PATH, "logs.log")
 
@@ -2,8 +2,9 @@ import enum
 from typing import Any
 
 from . import rows
+from . import aggregates
+from . import checks
 from . import logger_builder
-import checks
 
 logger = logger_builder.build_logger(__name__)
 
@@ -34,13 +35,29 @@ class SearchCondition:
 class Query():
     def __init__(
             self,
-            table: type | str,
+            table: type | str | aggregates.Aggregate,
             columns_filter:list[tuple[rows.Row | str, QueryComparaisonType]] =[], 
             to_select: list[rows.Row | str] =[],
             order_by:rows.Row | str =None, 
             ascending=False
         ):
-        self.table = table.__name__.lower() if isinstance(table, type) else table
+        if isinstance(table, type):
+            # une table partitionnée est lue dans tous les shards
+            db = getattr(table, "db", None)
+            if db is not None and db.is_sharded(table):
+                self.table = f"({db.get_union_string(table.__name__.lower())})"
+            else:
+                self.table = table.__name__.lower()
+        elif isinstance(table, aggregates.Aggregate):
+            # seules les colonnes visibles sont lues, et les groupes d'une table partitionnée
+            # sont additionnés sur tous les shards
+            db = getattr(table.table, "db", None)
+            if db is not None:
+                self.table = f"({db.get_aggregate_string(table)})"
+            else:
+                self.table = f"({table.get_select_string()})"
+        else:
+            self.table = table
         self.to_select = to_select
         self.columns_filter = columns_filter
         self.order_by = order_by
@@ -72,7 +89,7 @@ class Query():
 class SimpleQuery(Query):
     def __init__(
         self, 
-        table: type | str | Query, 
+        table: type | str | aggregates.Aggregate | Query, 
         columns_filter: list[tuple[rows.Row | str, QueryComparaisonType]] = [], 
         to_select: list[rows.Row | str] = [], 
         order_by: list[rows.Row | str] = [], 
@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+import pytest
+
+# les logs du package sont écrits dans un dossier temporaire et pas dans les fichiers suivis par git
+os.environ.setdefault("SQLITEORM_LOG_DIR", tempfile.mkdtemp(prefix="sqliteORM-logs-"))
+
+from sqliteORM import db, rows
+
+
+@pytest.fixture
+def make_table(tmp_path):
+    # cré une table avec un id et les rows données, sa base dans tmp_path et les tables de la base
+    def make(name, *columns, shard_by=None, aggregates=(), path=None, **options):
+        table = type(name, (db.DBTable,), {"shard_by": shard_by})
+        table.add_row(rows.DBRow.build_id_row())
+        for column in columns:
+            table.add_row(column)
+        for aggregate in aggregates:
+            table.add_aggregate(aggregate)
+        
+        database = db.DB({table}, path=str(path or tmp_path / "db.db"), **options)
+        table.db = database
+        database.create_tables()
+        
+        return table, database
+    
+    return make
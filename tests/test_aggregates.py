@@ -0,0 +1,118 @@
+import collections
+import random
+
+import pytest
+
+from sqliteORM import rows, types, query, Aggregate
+
+
+@pytest.fixture
+def purchases(make_table):
+    def make(shards=1, count=True):
+        customer = rows.DBRow("customer", types.INTEGER, nullable=True)
+        amount = rows.DBRow("amount", types.INTEGER)
+        aggregate = Aggregate("per_customer", group_by=customer, sum=amount, count=count)
+        
+        Purchase, database = make_table("Purchase", customer, amount, shard_by="customer", aggregates=[aggregate], shards=shards)
+        return Purchase, aggregate, database
+    
+    return make
+
+
+def insert(Purchase, values):
+    for customer, amount in values:
+        Purchase(customer=customer, amount=amount)
+    Purchase.db.commit()
+
+
+def on_every_shard(database, string, params=()):
+    for shard in range(database.shards):
+        database.execute(string, params, shard=shard)
+    database.commit()
+
+
+def expected(database, Purchase):
+    groups = collections.defaultdict(lambda: [0, 0])
+    for _, customer, amount in database.select(Purchase).fetchall():
+        groups[customer][0] += 1
+        groups[customer][1] += amount
+    
+    return sorted(((customer, *values) for customer, values in groups.items()), key=str)
+
+
+def summary(database, aggregate):
+    return sorted(database.select_aggregate(aggregate).fetchall(), key=str)
+
+
+@pytest.mark.parametrize("shards", [1, 3])
+def test_triggers_follow_changes(purchases, shards):
+    Purchase, aggregate, database = purchases(shards)
+    
+    insert(Purchase, [(i % 4 if i % 7 else None, i) for i in range(40)])
+    on_every_shard(database, "UPDATE purchase SET amount = amount + 100 WHERE customer = 1")
+    # changer la clé de partitionnement sur place ne se fait que sans shard
+    if shards == 1:
+        on_every_shard(database, "UPDATE purchase SET customer = 3 WHERE customer = 0")
+    on_every_shard(database, "DELETE FROM purchase WHERE customer = 2")
+    
+    assert summary(database, aggregate) == expected(database, Purchase)
+    assert 2 not in [customer for customer, _, _ in summary(database, aggregate)]
+
+
+def test_sum_only_aggregate_drops_empty_groups(purchases):
+    Purchase, aggregate, database = purchases(count=False)
+    
+    insert(Purchase, [(1, 0), (2, 5)])
+    database.execute("DELETE FROM purchase WHERE customer = 1")
+    database.commit()
+    
+    assert summary(database, aggregate) == [(2, 5)]
+    
+    database.rebuild_aggregate(aggregate)
+    
+    assert summary(database, aggregate) == [(2, 5)]
+
+
+def test_query_reads_every_shard(purchases):
+    Purchase, aggregate, database = purchases(shards=3)
+    insert(Purchase, [(i, i) for i in range(5)])
+    
+    string = query.SimpleQuery(aggregate).build_query()
+    
+    assert sorted(database.execute(string).fetchall()) == summary(database, aggregate)
+    assert len(summary(database, aggregate)) == 5
+
+
+@pytest.mark.parametrize("shards", [1, 3])
+def test_rebuild_backfills_existing_rows(purchases, shards):
+    Purchase, aggregate, database = purchases(shards)
+    insert(Purchase, [(i % 5, i) for i in range(50)])
+    
+    # simule des lignes écrites avant la déclaration de l'agrégat
+    on_every_shard(database, f"DELETE FROM {aggregate.get_table_name()}")
+    assert summary(database, aggregate) == []
+    
+    database.rebuild_aggregate(aggregate, chunk_size=7)
+    
+    assert summary(database, aggregate) == expected(database, Purchase)
+
+
+def test_rebuild_with_concurrent_changes(purchases):
+    Purchase, aggregate, database = purchases()
+    insert(Purchase, [(i % 10, i) for i in range(300)])
+    
+    changes = random.Random(0)
+    
+    def progress(shard, done, last):
+        # modifie des lignes déjà recopiées et d'autres pas encore lues entre deux lots
+        for id in (changes.randint(1, done), changes.randint(done + 1, last + 1)):
+            database.execute("UPDATE purchase SET amount = amount + 1, customer = ? WHERE id = ?", (changes.randint(0, 12), id))
+        database.execute("DELETE FROM purchase WHERE id = ?", (changes.randint(1, last),))
+        insert(Purchase, [(changes.randint(0, 12), 1)])
+        
+        # la table résumé reste complète et à jour pendant la reconstruction
+        assert summary(database, aggregate) == expected(database, Purchase)
+    
+    database.rebuild_aggregate(aggregate, chunk_size=20, progress=progress)
+    
+    assert summary(database, aggregate) == expected(database, Purchase)
@@ -0,0 +1,142 @@
+import gc
+import os
+import sqlite3
+import time
+
+import pytest
+
+from sqliteORM import rows, types
+
+
+@pytest.fixture
+def items(make_table):
+    # cré une table Item avec count lignes dans chaque shard
+    def make(shards=1, count=0, **options):
+        Item, database = make_table("Item", rows.DBRow("name", types.TEXT(200)), shard_by="name", shards=shards, **options)
+        
+        if count:
+            for shard in range(database.shards):
+                database.execute(
+                    "INSERT INTO item (name) VALUES (?)",
+                    [(f"{shard}-{i}-" + "x" * 150,) for i in range(count)],
+                    many=True,
+                    shard=shard
+                )
+            database.commit()
+        
+        return Item, database
+    
+    return make
+
+
+def count_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM item").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_backup_to_bare_filename(items, tmp_path, monkeypatch):
+    Item, database = items(count=10, path=tmp_path / "live" / "db.db")
+    monkeypatch.chdir(tmp_path)
+    
+    assert database.backup("bk.db") == ["bk.db"]
+    assert count_rows(tmp_path / "bk.db") == 10
+
+
+def test_backup_copies_every_shard(items, tmp_path):
+    Item, database = items(shards=3, count=5)
+    
+    paths = database.backup(str(tmp_path / "backup" / "bk.db"))
+    
+    assert [os.path.basename(path) for path in paths] == ["bk.db", "bk.shard1.db", "bk.shard2.db"]
+    assert [count_rows(path) for path in paths] == [5, 5, 5]
+
+
+def test_backup_keeps_journal_mode_and_caller_transaction(items, tmp_path):
+    Item, database = items(count=5)
+    
+    # écriture de l'appelant pas encore commit
+    database.execute("INSERT INTO item (name) VALUES ('pending')")
+    database.backup(str(tmp_path / "bk.db"))
+    
+    conn = database.get_conn()
+    assert conn.in_transaction
+    assert count_rows(tmp_path / "bk.db") == 5
+    
+    conn.rollback()
+    assert count_rows(database.path) == 5
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal"
+
+
+def test_backup_starts_while_another_writer_holds_a_transaction(items, tmp_path):
+    Item, database = items(count=5, wal=True)
+    
+    writer = sqlite3.connect(database.path, timeout=0.1)
+    writer.execute("INSERT INTO item (name) VALUES ('pending')")
+    
+    database.backup(str(tmp_path / "bk.db"))
+    writer.commit()
+    
+    assert count_rows(tmp_path / "bk.db") == 5
+    assert count_rows(database.path) == 6
+
+
+def test_backup_is_throttled_and_not_restarted_by_writers(items, tmp_path):
+    Item, database = items(count=2000, wal=True)
+    writer = sqlite3.connect(database.path, timeout=0.1)
+    steps = []
+    
+    def progress(status, remaining, total):
+        steps.append(remaining)
+        # une autre connection écrit pendant la copie sans être bloquée
+        writer.execute("INSERT INTO item (name) VALUES ('new')")
+        writer.commit()
+    
+    start = time.monotonic()
+    database.backup(str(tmp_path / "bk.db"), pages_per_step=10, sleep=0.001, progress=progress)
+    elapsed = time.monotonic() - start
+    
+    # la copie n'est jamais recommencée : le nombre de pages restantes ne fait que baisser
+    assert steps == sorted(steps, reverse=True)
+    assert elapsed >= (len(steps) - 1) * 0.001
+    # la copie contient l'état du début de la sauvegarde
+    assert count_rows(tmp_path / "bk.db") == 2000
+    assert count_rows(database.path) == 2000 + len(steps)
+
+
+def test_snapshot_is_read_only_and_removed_on_close(items, tmp_path):
+    Item, database = items(shards=2, count=3, path=tmp_path / "a?b#c%d" / "db.db")
+    
+    snapshot = database.snapshot()
+    temp_dir = snapshot.temp_dir
+    
+    assert snapshot.execute("SELECT COUNT(*) FROM main.item").fetchone() == (3,)
+    assert snapshot.execute("SELECT COUNT(*) FROM shard1.item").fetchone() == (3,)
+    with pytest.raises(sqlite3.OperationalError):
+        snapshot.execute("DELETE FROM item")
+    
+    snapshot.close()
+    assert not os.path.exists(temp_dir)
+
+
+def test_snapshot_is_removed_when_not_closed(items):
+    Item, database = items(count=3)
+    
+    snapshot = database.snapshot()
+    temp_dir = snapshot.temp_dir
+    del snapshot
+    gc.collect()
+    
+    assert not os.path.exists(temp_dir)
+
+
+def test_in_memory_snapshot(items):
+    Item, database = items(count=3)
+    
+    snapshot = database.snapshot(in_memory=True)
+    
+    assert snapshot.execute("SELECT COUNT(*) FROM item").fetchone() == (3,)
+    with pytest.raises(sqlite3.OperationalError):
+        snapshot.execute("DELETE FROM item")
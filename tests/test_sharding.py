@@ -0,0 +1,142 @@
+import sqlite3
+import threading
+
+import pytest
+
+from sqliteORM import db, query, rows, types
+
+
+@pytest.fixture
+def purchases(make_table):
+    return make_table(
+        "Purchase",
+        rows.DBRow("customer", types.INTEGER),
+        rows.DBRow("amount", types.INTEGER),
+        shard_by="customer",
+        shards=3
+    )
+
+
+def read_shard(database, shard):
+    conn = sqlite3.connect(database.get_shard_path(database.path, shard))
+    try:
+        return conn.execute("SELECT id, customer, amount FROM purchase").fetchall()
+    finally:
+        conn.close()
+
+
+def test_rows_are_routed_by_shard_key(purchases):
+    Purchase, database = purchases
+    
+    for customer in range(6):
+        Purchase(customer=customer, amount=customer * 10)
+    database.commit()
+    
+    for shard in range(3):
+        customers = [customer for _, customer, _ in read_shard(database, shard)]
+        assert sorted(customers) == [shard, shard + 3]
+
+
+def test_ids_are_unique_across_shards(purchases):
+    Purchase, database = purchases
+    
+    created = [Purchase(customer=customer, amount=customer)._values for customer in range(9)]
+    database.commit()
+    
+    ids = [values["id"] for values in created]
+    assert len(set(ids)) == len(ids)
+    
+    # sans la clé de partitionnement, l'id suffit à trouver la bonne ligne
+    for values in created:
+        assert Purchase.get_data(id=values["id"]) == values
+
+
+def test_explicit_id_in_wrong_shard_is_rejected(purchases):
+    Purchase, database = purchases
+    
+    with pytest.raises(db.ArgumentError):
+        Purchase(id=2, customer=0, amount=0)
+
+
+def test_cross_shard_select_is_ordered(purchases):
+    Purchase, database = purchases
+    
+    for customer in range(6):
+        Purchase(customer=customer, amount=customer * 10)
+    database.commit()
+    
+    amounts = [amount for _, _, amount in database.select(Purchase, _order_by="amount", _ascending=False).fetchall()]
+    assert amounts == [50, 40, 30, 20, 10, 0]
+
+
+def test_too_many_shards_is_rejected(tmp_path):
+    with pytest.raises(db.ArgumentError):
+        db.DB(set(), path=str(tmp_path / "db.db"), shards=db.MAX_SHARDS + 1)
+
+
+def test_threads_have_their_own_transactions(purchases):
+    Purchase, database = purchases
+    
+    # écriture non validée dans le shard 1 par le thread principal
+    Purchase(customer=1, amount=1)
+    
+    def write():
+        Purchase(customer=2, amount=2)
+        database.commit()
+    
+    thread = threading.Thread(target=write)
+    thread.start()
+    thread.join()
+    
+    # le commit de l'autre thread n'a pas validé l'écriture du thread principal
+    database.get_conn(shard=1).rollback()
+    
+    assert read_shard(database, 1) == []
+    assert [customer for _, customer, _ in read_shard(database, 2)] == [2]
+
+
+def test_query_reads_every_shard(purchases):
+    Purchase, database = purchases
+    
+    for customer in range(7):
+        Purchase(customer=customer, amount=customer)
+    database.commit()
+    
+    string = query.SimpleQuery(Purchase).build_query()
+    
+    assert len(database.execute(string).fetchall()) == 7
+
+
+def test_reads_without_key_see_uncommitted_writes(purchases):
+    Purchase, database = purchases
+    
+    values = Purchase(customer=1, amount=10)._values
+    
+    assert Purchase.get_data(amount=10) == values
+    assert Purchase.get_data(customer=1, amount=10) == values
+
+
+def test_deleted_id_is_not_reused(purchases):
+    Purchase, database = purchases
+    
+    values = Purchase(customer=1, amount=1)._values
+    database.execute("DELETE FROM purchase WHERE id = ?", (values["id"],), shard=1)
+    
+    assert Purchase(customer=1, amount=2)._values["id"] == values["id"] + 3
+
+
+def test_failed_insert_raises(make_table):
+    Account, database = make_table(
+        "Account",
+        rows.DBRow("name", types.TEXT(20), unique=True),
+        rows.DBRow("shard", types.INTEGER),
+        shard_by="name",
+        shards=3
+    )
+    
+    # une row peut s'appeler comme un paramètre de select
+    values = Account(name="a", shard=1)._values
+    assert Account.get_data(shard=1) == values
+    
+    with pytest.raises(sqlite3.DatabaseError):
+        Account(name="a", shard=2)